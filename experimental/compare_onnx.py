@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# Compare the output and speed of the 'onnx' engine against the
+# 'silero' model it was converted from:
+#
+#   python3 experimental/compare_onnx.py ~/.cache/ttsprech/silero/en.pt ~/.cache/ttsprech/onnx/en.onnx
+#
+# Each engine runs in its own process, so import time and memory use
+# aren't shared between them.
+
+from typing import Any, Dict, List
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+SENTENCES = [
+    "Hello World.",
+    "The quick brown fox jumps over the lazy dog.",
+    "This is a somewhat longer sentence, to see how the synthesis time grows with the length of the input text.",
+    "Short one!",
+    "Is this the real life, or is this just fantasy?",
+]
+
+
+def run_engine(opts: argparse.Namespace, sentences: List[str]) -> Dict[str, Any]:
+    """Synthesize all sentences with one engine, runs in the child process"""
+    start = time.perf_counter()
+    if opts.run == "silero":
+        from ttsprech.silero import silero_model_from_file
+        import_time = time.perf_counter() - start
+        model: Any = silero_model_from_file(opts.SILERO, opts.rate)
+    else:
+        from ttsprech.onnx import onnx_model_from_file
+        import_time = time.perf_counter() - start
+        model = onnx_model_from_file(opts.ONNX, opts.threads)
+    load_time = time.perf_counter() - start - import_time
+
+    speaker = opts.speaker or model.speakers[0]
+
+    times = []
+    for idx, text in enumerate(sentences):
+        outfile = os.path.join(opts.outdir, f"{opts.run}-{idx:04d}.wav")
+        best = float("inf")
+        for _ in range(opts.repeat):
+            sentence_start = time.perf_counter()
+            model.save_wav(outfile=outfile, text=text, speaker=speaker, sample_rate=opts.rate, ssml=False)
+            best = min(best, time.perf_counter() - sentence_start)
+        times.append(best)
+
+    return {
+        "import_time": import_time,
+        "load_time": load_time,
+        "times": times,
+        "maxrss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "torch_loaded": "torch" in sys.modules,
+    }
+
+
+def read_wav(filename: str) -> Any:
+    import numpy as np
+
+    with wave.open(filename, "rb") as fin:
+        return np.frombuffer(fin.readframes(fin.getnframes()), dtype="<i2").astype(np.float32) / 32767
+
+
+def compare(opts: argparse.Namespace, sentences: List[str]) -> None:
+    import numpy as np
+
+    results = {}
+    for engine in ("silero", "onnx"):
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--run", engine,
+                                          "--outdir", opts.outdir] + sys.argv[1:])
+        results[engine] = json.loads(output.decode().splitlines()[-1])
+
+    print(f"{'':>4} {'silero':>9} {'onnx':>9} {'speedup':>8} {'max diff':>9} {'snr dB':>7}  text")
+    for idx, text in enumerate(sentences):
+        expected = read_wav(os.path.join(opts.outdir, f"silero-{idx:04d}.wav"))
+        actual = read_wav(os.path.join(opts.outdir, f"onnx-{idx:04d}.wav"))
+        if expected.shape != actual.shape:
+            diff_str, snr_str = f"{len(actual) - len(expected):+d} smp", "-"
+        else:
+            noise = float(np.sum((actual - expected) ** 2))
+            diff_str = f"{float(np.abs(actual - expected).max()):.2e}"
+            snr_str = "inf" if noise == 0 else f"{10 * np.log10(float(np.sum(expected ** 2)) / noise):.1f}"
+
+        silero_time = results["silero"]["times"][idx]
+        onnx_time = results["onnx"]["times"][idx]
+        print(f"{idx:4d} {silero_time:8.3f}s {onnx_time:8.3f}s {silero_time / onnx_time:7.2f}x "
+              f"{diff_str:>9} {snr_str:>7}  {text[:40]!r}")
+
+    print()
+    for engine, result in results.items():
+        print(f"{engine:>6}: import {result['import_time']:.2f}s, load {result['load_time']:.2f}s, "
+              f"total synth {sum(result['times']):.2f}s, maxrss {result['maxrss_mb']:.0f} MB, "
+              f"torch loaded: {result['torch_loaded']}")
+
+
+def parse_args(args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare the onnx engine against silero")
+    parser.add_argument("SILERO", help="Silero torch.package .pt file")
+    parser.add_argument("ONNX", help="ONNX model converted from it")
+    parser.add_argument("-f", "--file", metavar="FILE", default=None,
+                        help="Text file with one sentence per line")
+    parser.add_argument("-s", "--speaker", default=None, help="Speaker to use")
+    parser.add_argument("-r", "--rate", type=int, default=24000,
+                        help="Sample rate, should match the rate the model was converted with")
+    parser.add_argument("-t", "--threads", type=int, default=4, help="ONNX Runtime threads")
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="Take the best of N runs per sentence")
+    parser.add_argument("--run", choices=["silero", "onnx"], default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--outdir", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(args)
+
+
+def main(argv: List[str]) -> None:
+    opts = parse_args(argv[1:])
+
+    if opts.file is None:
+        sentences = SENTENCES
+    else:
+        with open(opts.file) as fin:
+            sentences = [line.strip() for line in fin if line.strip()]
+
+    if opts.run is not None:
+        print(json.dumps(run_engine(opts, sentences)))
+    else:
+        with tempfile.TemporaryDirectory() as outdir:
+            opts.outdir = outdir
+            compare(opts, sentences)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
+
+
+# EOF #
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+# Convert a Silero v3 torch.package model into the ONNX format used by
+# `ttsprech --engine onnx`, see ttsprech/onnx.py for the interface.
+#
+#   python3 experimental/silero_to_onnx.py ~/.cache/ttsprech/silero/en.pt
+#
+# writes ~/.cache/ttsprech/onnx/en.onnx. Silero doesn't document the
+# network behind apply_tts(), so the call it makes into `model.model`
+# is recorded and the export replays it with the text and speaker
+# arguments replaced. The result is checked against apply_tts() before
+# it is written.
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import torch
+from xdg.BaseDirectory import xdg_cache_home
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ttsprech.onnx import prepare_text_input  # noqa: E402
+from ttsprech.silero import SILERO_DEFAULT_SYNTH_RATE, SILERO_SAMPLE_RATES  # noqa: E402
+
+
+# texts used to check that the ids from prepare_text_input() match
+# the ones Silero feeds into the network
+CHECK_TEXTS = [
+    "Hello World",
+    "This is a test, with punctuation!",
+    "  Mixed CASE and   whitespace?  ",
+    "Numbers like 42 and symbols like % are dropped.",
+]
+
+
+class Recorder(torch.nn.Module):
+    """Wraps the inner network of a Silero model and records its calls"""
+
+    def __init__(self, inner: Any) -> None:
+        super().__init__()
+        self.inner = inner
+        self.calls: List[Tuple[Tuple[Any, ...], Dict[str, Any], Any]] = []
+
+    def forward(self, *args: Any, **kwargs: Any) -> Any:
+        result = self.inner(*args, **kwargs)
+        self.calls.append((args, kwargs, result))
+        return result
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self.inner, name)
+
+
+def record_call(model: Any, text: str, speaker: str, sample_rate: int) -> Tuple[List[Any], Any, torch.Tensor]:
+    """Run apply_tts() and return the arguments it passed to the network,
+    the network's result and the final audio"""
+    recorder = Recorder(model.model)
+    model.model = recorder
+    try:
+        with torch.no_grad():
+            audio = model.apply_tts(text=text, speaker=speaker, sample_rate=sample_rate)
+    finally:
+        model.model = recorder.inner
+
+    if len(recorder.calls) != 1:
+        raise RuntimeError(f"expected apply_tts() to call the network once, got {len(recorder.calls)} calls")
+
+    args, kwargs, result = recorder.calls[0]
+    if kwargs:
+        raise RuntimeError(f"keyword arguments to the network are not supported: {sorted(kwargs)}")
+
+    return list(args), result, audio
+
+
+def same_arg(lhs: Any, rhs: Any) -> bool:
+    if isinstance(lhs, torch.Tensor) and isinstance(rhs, torch.Tensor):
+        return lhs.shape == rhs.shape and torch.equal(lhs, rhs)
+    return type(lhs) is type(rhs) and bool(lhs == rhs)  # pylint: disable=unidiomatic-typecheck
+
+
+def find_ids_arg(args: Sequence[Any], expected: List[int]) -> int:
+    for idx, arg in enumerate(args):
+        if isinstance(arg, torch.Tensor) and arg.dtype == torch.int64 and arg.dim() == 2 and \
+           arg.shape[0] == 1 and arg[0].tolist() == expected:
+            return idx
+    raise RuntimeError(f"Silero's text ids don't match prepare_text_input(): {expected}")
+
+
+def find_audio(result: Any) -> int:
+    """Return the index of the waveform in the network's result"""
+    outputs = result if isinstance(result, (tuple, list)) else [result]
+    for idx, output in enumerate(outputs):
+        if isinstance(output, torch.Tensor) and output.is_floating_point():
+            return idx
+    raise RuntimeError("no waveform found in the network's result")
+
+
+class Exportable(torch.nn.Module):
+    """Replays the recorded call with the ids and the speaker table
+    lookup as the only inputs"""
+
+    def __init__(self, inner: Any, args: List[Any], ids_idx: int, length_idx: Optional[int],
+                 speaker_idx: Optional[int], speaker_table: Optional[torch.Tensor],
+                 audio_idx: Optional[int]) -> None:
+        super().__init__()
+        self.inner = inner
+        self.args = args
+        self.ids_idx = ids_idx
+        self.length_idx = length_idx
+        self.speaker_idx = speaker_idx
+        self.audio_idx = audio_idx
+        if speaker_table is not None:
+            self.register_buffer("speaker_table", speaker_table)
+
+    def forward(self, input: torch.Tensor, speaker: torch.Tensor) -> torch.Tensor:  # pylint: disable=W0622
+        args = list(self.args)
+        args[self.ids_idx] = input
+        if self.length_idx is not None:
+            args[self.length_idx] = torch.ones_like(self.args[self.length_idx]) * input.shape[1]
+        if self.speaker_idx is not None:
+            args[self.speaker_idx] = self.speaker_table[speaker[0]]
+        result = self.inner(*args)
+        audio = result if self.audio_idx is None else result[self.audio_idx]
+        return audio.reshape(1, -1)
+
+
+def build_exportable(model: Any, symbols: str, speakers: List[str], sample_rate: int) -> Exportable:
+    text_args = []
+    for text in CHECK_TEXTS:
+        args, _, _ = record_call(model, text, speakers[0], sample_rate)
+        ids_idx = find_ids_arg(args, prepare_text_input(text, symbols))
+        text_args.append(args)
+
+    # an argument that follows the text length is recomputed from the input
+    length_idx: Optional[int] = None
+    for idx, arg in enumerate(text_args[0]):
+        if idx == ids_idx:
+            continue
+        values = [args[idx] for args in text_args]
+        if all(isinstance(value, torch.Tensor) and value.numel() == 1 and
+               int(value) == args[ids_idx].shape[1] for value, args in zip(values, text_args)):
+            length_idx = idx
+        elif any(not same_arg(value, arg) for value in values):
+            raise RuntimeError(f"network argument {idx} depends on the text in an unknown way")
+
+    recordings = [record_call(model, CHECK_TEXTS[0], speaker, sample_rate) for speaker in speakers]
+    args, result, _ = recordings[0]
+
+    # the argument that changes with the speaker is looked up in a table
+    speaker_idx: Optional[int] = None
+    speaker_table: Optional[torch.Tensor] = None
+    for idx, arg in enumerate(args):
+        values = [rec[0][idx] for rec in recordings]
+        if all(same_arg(value, arg) for value in values):
+            continue
+        if not isinstance(arg, torch.Tensor):
+            raise RuntimeError(f"network argument {idx} depends on the speaker but isn't a tensor: {values}")
+        if speaker_idx is not None:
+            raise RuntimeError("more than one network argument depends on the speaker")
+        speaker_idx = idx
+        speaker_table = torch.stack(values)
+
+    if speaker_idx is None and len(speakers) > 1:
+        raise RuntimeError("no network argument depends on the speaker")
+
+    audio_idx = find_audio(result) if isinstance(result, (tuple, list)) else None
+    return Exportable(model.model, args, ids_idx, length_idx, speaker_idx, speaker_table, audio_idx)
+
+
+def check_parity(model_file: str, model: Any, symbols: str, speakers: List[str], sample_rate: int) -> None:
+    import onnxruntime
+
+    session = onnxruntime.InferenceSession(model_file, providers=["CPUExecutionProvider"])
+    for speaker_idx, speaker in enumerate(speakers):
+        for text in CHECK_TEXTS:
+            with torch.no_grad():
+                expected = model.apply_tts(text=text, speaker=speaker, sample_rate=sample_rate).numpy()
+            (audio,) = session.run(["audio"], {
+                "input": np.array([prepare_text_input(text, symbols)], dtype=np.int64),
+                "speaker": np.array([speaker_idx], dtype=np.int64),
+            })
+            audio = audio[0]
+            if audio.shape != expected.shape:
+                raise RuntimeError(f"{speaker}: {text!r}: length mismatch {audio.shape} != {expected.shape}")
+            diff = float(np.abs(audio - expected).max())
+            if diff > 1e-3:
+                raise RuntimeError(f"{speaker}: {text!r}: waveform differs by {diff}")
+            print(f"ok: {speaker}: {text!r}: max diff {diff:.2e}")
+
+
+def parse_args(args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Convert a Silero v3 model to ONNX for ttsprech")
+    parser.add_argument("MODEL", help="Silero torch.package .pt file")
+    parser.add_argument("-o", "--output", metavar="FILE", default=None,
+                        help="Output file, defaults to ~/.cache/ttsprech/onnx/<name>.onnx")
+    parser.add_argument("-r", "--rate", type=int, default=SILERO_DEFAULT_SYNTH_RATE,
+                        help=f"Synthesis rate baked into the model, one of "
+                        f"{' '.join(str(rate) for rate in SILERO_SAMPLE_RATES)}")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset version")
+    return parser.parse_args(args)
+
+
+def main(argv: List[str]) -> None:
+    import onnx
+
+    opts = parse_args(argv[1:])
+    if opts.rate not in SILERO_SAMPLE_RATES:
+        raise RuntimeError(f"unsupported rate '{opts.rate}'")
+
+    output = opts.output
+    if output is None:
+        name = os.path.splitext(os.path.basename(opts.MODEL))[0]
+        output = os.path.join(xdg_cache_home, "ttsprech", "onnx", f"{name}.onnx")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    model = torch.package.PackageImporter(opts.MODEL).load_pickle("tts_models", "model")  # type: ignore
+    model.to(torch.device("cpu"))
+
+    symbols = getattr(model, "symbols", None)
+    if not isinstance(symbols, str):
+        raise RuntimeError("model has no 'symbols' string, not a Silero v3 model?")
+
+    # 'random' generates a new voice on every call, it can't be exported
+    speakers = [speaker for speaker in model.speakers if speaker != "random"]
+    if any("," in speaker for speaker in speakers):
+        raise RuntimeError("speaker names must not contain ','")
+
+    exportable = build_exportable(model, symbols, speakers, opts.rate)
+    exportable.eval()
+
+    ids = torch.tensor([prepare_text_input(CHECK_TEXTS[0], symbols)], dtype=torch.int64)
+    speaker = torch.zeros(1, dtype=torch.int64)
+
+    tmp_file = f"{output}.tmp{os.getpid()}"
+    with torch.no_grad():
+        torch.onnx.export(exportable, (ids, speaker), tmp_file,
+                          input_names=["input", "speaker"],
+                          output_names=["audio"],
+                          dynamic_axes={"input": {1: "T"}, "audio": {1: "N"}},
+                          opset_version=opts.opset,
+                          dynamo=False)
+
+    onnx_model = onnx.load(tmp_file)
+    for key, value in (("symbols", symbols),
+                       ("speakers", ",".join(speakers)),
+                       ("sample_rate", str(opts.rate))):
+        prop = onnx_model.metadata_props.add()
+        prop.key = key
+        prop.value = value
+    onnx.save(onnx_model, tmp_file)
+
+    try:
+        check_parity(tmp_file, model, symbols, speakers, opts.rate)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+    os.replace(tmp_file, output)
+    print(f"written {output}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
+
+
+# EOF #
@@ -68,6 +68,8 @@
               langdetect
               nltk
               num2words
+              numpy
+              onnxruntime
               pyxdg
               simpleaudio
               torch
@@ -0,0 +1,94 @@
+# ttsprech - simple text to wav for the command line
+# Copyright (C) 2022 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from typing import Tuple
+
+import functools
+import logging
+import math
+import wave
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+logger = logging.getLogger(__name__)
+
+
+LOWPASS_FILTER_WIDTH = 6
+ROLLOFF = 0.99
+
+
+@functools.lru_cache(maxsize=None)
+def _sinc_kernel(orig_rate: int, new_rate: int) -> Tuple[np.ndarray, int]:
+    """Build the windowed sinc polyphase kernel for a reduced rate pair,
+    the result has shape (new_rate, 2 * width + orig_rate)"""
+    base_rate = min(orig_rate, new_rate) * ROLLOFF
+    width = math.ceil(LOWPASS_FILTER_WIDTH * orig_rate / base_rate)
+
+    idx = np.arange(-width, width + orig_rate, dtype=np.float64)[None, :] / orig_rate
+    t = np.arange(0, -new_rate, -1, dtype=np.float64)[:, None] / new_rate + idx
+    t *= base_rate
+    t = np.clip(t, -LOWPASS_FILTER_WIDTH, LOWPASS_FILTER_WIDTH)
+
+    # Hann window
+    window = np.cos(t * math.pi / LOWPASS_FILTER_WIDTH / 2) ** 2
+    t *= math.pi
+    kernel = np.where(t == 0, 1.0, np.sin(t) / np.where(t == 0, 1.0, t))
+    kernel *= window * (base_rate / orig_rate)
+
+    return kernel.astype(np.float32), width
+
+
+def resample(waveform: np.ndarray, orig_rate: int, new_rate: int) -> np.ndarray:
+    """Resample `waveform` from `orig_rate` to `new_rate` using band
+    limited sinc interpolation. `waveform` has the shape (..., time),
+    all leading dimensions are processed as a single batch."""
+    if orig_rate == new_rate:
+        return waveform
+
+    gcd = math.gcd(orig_rate, new_rate)
+    orig_rate //= gcd
+    new_rate //= gcd
+
+    kernel, width = _sinc_kernel(orig_rate, new_rate)
+
+    shape = waveform.shape
+    batch = waveform.reshape(-1, shape[-1]).astype(np.float32)
+    num_wavs, length = batch.shape
+
+    batch = np.pad(batch, ((0, 0), (width, width + orig_rate)))
+    frames = sliding_window_view(batch, kernel.shape[1], axis=-1)[:, ::orig_rate]
+    resampled = (frames @ kernel.T).reshape(num_wavs, -1)
+
+    target_length = math.ceil(new_rate * length / orig_rate)
+    resampled = resampled[:, :target_length]
+
+    return resampled.reshape(shape[:-1] + resampled.shape[-1:])
+
+
+def write_wav(outfile: str, waveform: np.ndarray, sample_rate: int) -> None:
+    """Write a mono float waveform in the range [-1, 1] as 16bit PCM .wav"""
+    samples = (np.clip(waveform, -1.0, 1.0) * 32767).astype("<i2")
+
+    with wave.open(outfile, "wb") as fout:
+        fout.setnchannels(1)
+        fout.setsampwidth(2)
+        fout.setframerate(sample_rate)
+        fout.writeframes(samples.tobytes())
+
+
+# EOF #
@@ -20,6 +20,9 @@ from typing import Any, Dict, List, Tuple, TYPE_CHECKING
 import logging
 from threading import Lock
 from pathlib import Path
+import numpy as np
+
+from ttsprech.audio import resample, write_wav
 
 if TYPE_CHECKING:
     from TTS.utils.synthesizer import Synthesizer
@@ -45,20 +48,23 @@ class CoquiModel:
         return [""]  # cast(List[str], self._synthesizer.tts_model.language_manager.ids)
 
     def save_wav(self, outfile: str, text: str, speaker: str, sample_rate: int, ssml: bool) -> None:
-        del sample_rate  # FIXME: ignore sample_rate for now
-
         if ssml:
             # https://github.com/coqui-ai/TTS/pull/1452
             raise RuntimeError("SSML is not supported by 'conqui'")
 
         lock, synthesizer = self._find_synth()
         with lock:
-            wav: List[int] = synthesizer.tts(
+            wav: List[float] = synthesizer.tts(
                 text=text,
                 speaker_name=speaker,
                 language_name="",
             )
-            synthesizer.save_wav(wav, outfile)
+            synth_rate: int = synthesizer.output_sample_rate
+
+        # normalize the peak the same way Synthesizer.save_wav() does
+        audio = np.asarray(wav, dtype=np.float32)
+        audio = audio / max(0.01, float(np.abs(audio).max()))
+        write_wav(outfile, resample(audio, synth_rate, sample_rate), sample_rate)
 
     def _find_synth(self) -> Tuple[Lock, 'Synthesizer']:
         from TTS.utils.synthesizer import Synthesizer
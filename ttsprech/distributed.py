@@ -0,0 +1,288 @@
+# ttsprech - simple text to wav for the command line
+# Copyright (C) 2022 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Protocol: every message is a 4 byte big endian length, followed by
+# a JSON header of that length, followed by "size" bytes of payload.
+#
+#   coordinator -> worker  {"type": "config", ...}
+#   worker -> coordinator  {"type": "ready"}
+#   coordinator -> worker  {"type": "shard", "text": TEXT}
+#   worker -> coordinator  {"type": "result", "ok": BOOL, ["error": MSG]} + .wav
+#   ...
+#   coordinator -> worker  {"type": "done"}
+#
+# Workers connect to the coordinator and pull one sentence at a time
+# per connection, a sentence in flight on a connection that breaks is
+# handed to the next worker.
+
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import itertools
+import json
+import logging
+import os
+import socket
+import stat
+import struct
+import tempfile
+from concurrent.futures import Future
+from queue import Empty, PriorityQueue
+from threading import Event, Lock, Thread
+
+
+logger = logging.getLogger(__name__)
+
+
+HEADER_SIZE = struct.Struct("!I")
+
+Shard = Tuple[int, str, str, Event, Future[Optional[str]]]
+
+
+def parse_address(address: str) -> Tuple[int, Any]:
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+
+    host, sep, port = address.rpartition(":")
+    if not sep or not port.isdigit():
+        raise RuntimeError(f"invalid address '{address}', must be HOST:PORT or unix:PATH")
+
+    return socket.AF_INET, (host, int(port))
+
+
+def send_message(sock: socket.socket, header: Dict[str, Any], payload: bytes = b"") -> None:
+    data = json.dumps({**header, "size": len(payload)}).encode()
+    sock.sendall(HEADER_SIZE.pack(len(data)) + data + payload)
+
+
+def recv_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks: List[bytes] = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 16))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_message(sock: socket.socket) -> Tuple[Dict[str, Any], bytes]:
+    (header_size,) = HEADER_SIZE.unpack(recv_exactly(sock, HEADER_SIZE.size))
+    header: Dict[str, Any] = json.loads(recv_exactly(sock, header_size))
+    payload = recv_exactly(sock, header["size"])
+    return header, payload
+
+
+class Coordinator:
+    """Hands out sentences to `ttsprech --worker` processes and writes
+    the returned .wav files, offers the same submit()/shutdown()
+    interface as the local thread pool"""
+
+    def __init__(self, address: str, config: Dict[str, Any]) -> None:
+        self._config = config
+        self._queue: PriorityQueue[Shard] = PriorityQueue()
+        self._seq = itertools.count()
+        self._stopped = Event()
+        self._lock = Lock()
+        self._connections: List[socket.socket] = []
+        self._threads: List[Thread] = []
+
+        family, addr = parse_address(address)
+        self._unix_path: Optional[str] = addr if family == socket.AF_UNIX else None
+
+        self._server = socket.socket(family, socket.SOCK_STREAM)
+        if self._unix_path is not None:
+            if os.path.exists(self._unix_path) and stat.S_ISSOCK(os.stat(self._unix_path).st_mode):
+                os.remove(self._unix_path)
+        else:
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(addr)
+        self._server.listen()
+        self._server.settimeout(0.1)
+
+        logger.info(f"Coordinator waiting for workers on {address}")
+        self._accept_thread = Thread(target=lambda: self._accept(), daemon=True)
+        self._accept_thread.start()
+
+    def submit(self, outfile: str, text: str, skip: Event) -> Future[Optional[str]]:
+        future: Future[Optional[str]] = Future()
+        self._queue.put((next(self._seq), outfile, text, skip, future))
+        return future
+
+    def shutdown(self, cancel: bool) -> None:
+        self._stopped.set()
+        self._accept_thread.join()
+        self._server.close()
+
+        if cancel:
+            # abandon the sentences that are in flight on the workers
+            with self._lock:
+                for conn in self._connections:
+                    try:
+                        conn.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+        for thread in self._threads:
+            thread.join()
+
+        while not self._queue.empty():
+            _, _, _, _, future = self._queue.get()
+            if not future.cancel() and not future.done():
+                future.set_result(None)
+
+        if self._unix_path is not None:
+            os.remove(self._unix_path)
+
+    def _accept(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                conn, peer = self._server.accept()
+            except socket.timeout:
+                continue
+
+            logger.info(f"Coordinator: worker connected {peer!r}")
+            conn.settimeout(None)
+            thread = Thread(target=self._serve, args=(conn, peer))
+            with self._lock:
+                self._connections.append(conn)
+                self._threads.append(thread)
+            thread.start()
+
+    def _serve(self, conn: socket.socket, peer: Any) -> None:
+        try:
+            send_message(conn, {**self._config, "type": "config"})
+            recv_message(conn)  # ready
+
+            while not self._stopped.is_set():
+                try:
+                    shard = self._queue.get(timeout=0.1)
+                except Empty:
+                    continue
+
+                _, outfile, text, skip, future = shard
+                if not future.running() and not future.set_running_or_notify_cancel():
+                    continue
+
+                if skip.is_set():
+                    future.set_result(None)
+                    continue
+
+                try:
+                    send_message(conn, {"type": "shard", "text": text})
+                    header, payload = recv_message(conn)
+                    if not isinstance(header.get("ok"), bool):
+                        raise ValueError(f"malformed reply: {header!r}")
+                except Exception:
+                    # re-dispatch to another worker and drop this one,
+                    # also when the reply was malformed
+                    self._queue.put(shard)
+                    raise
+
+                if skip.is_set():
+                    # skipped while in flight, drop the result
+                    future.set_result(None)
+                else:
+                    self._finish(future, outfile, text, header, payload)
+
+            send_message(conn, {"type": "done"})
+        except Exception as err:  # pylint: disable=broad-except
+            if not self._stopped.is_set():
+                logger.warning(f"Coordinator: lost worker {peer!r}: {err!r}")
+        finally:
+            conn.close()
+
+    def _finish(self, future: Future[Optional[str]], outfile: str, text: str,
+                header: Dict[str, Any], payload: bytes) -> None:
+        if header["ok"]:
+            try:
+                with open(outfile, "wb") as fout:
+                    fout.write(payload)
+            except OSError as err:
+                future.set_exception(RuntimeError(f"failed to write {outfile}: {err}"))
+                return
+            logger.info(f"Written: {outfile}")
+            future.set_result(outfile)
+        elif "error" in header:
+            future.set_exception(RuntimeError(f"worker failed to process {text!r}: {header['error']}"))
+        else:
+            future.set_result(None)
+
+
+def connect(address: str) -> socket.socket:
+    family, addr = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.connect(addr)
+    except OSError as err:
+        sock.close()
+        raise RuntimeError(f"failed to connect to coordinator at {address}: {err}") from err
+    return sock
+
+
+def work(conn: socket.socket, synthesizer: Any) -> None:
+    with conn, tempfile.TemporaryDirectory(prefix="ttsprech-worker-") as tmpdir:
+        outfile = os.path.join(tmpdir, "sentence.wav")
+        try:
+            send_message(conn, {"type": "ready"})
+
+            while True:
+                header, _ = recv_message(conn)
+                if header["type"] == "done":
+                    break
+
+                try:
+                    result = synthesizer.submit(outfile, header["text"], Event()).result()
+                except Exception as err:  # pylint: disable=broad-except
+                    logger.error(f"failed to process {header['text']!r}: {err!r}")
+                    send_message(conn, {"type": "result", "ok": False, "error": str(err)})
+                    continue
+
+                if result is None:
+                    send_message(conn, {"type": "result", "ok": False})
+                else:
+                    with open(result, "rb") as fin:
+                        send_message(conn, {"type": "result", "ok": True}, fin.read())
+                    os.remove(result)
+        except OSError as err:
+            logger.info(f"Worker: connection to coordinator closed: {err}")
+
+
+def run_worker(address: str, max_workers: int, setup: Callable[[Dict[str, Any]], Any]) -> None:
+    """Connect to the coordinator at `address` with `max_workers`
+    connections and synthesize sentences until it is done, `setup`
+    turns the config into a synthesizer offering submit()/shutdown()"""
+    conns = [connect(address) for _ in range(max_workers)]
+
+    config, _ = recv_message(conns[0])
+    for conn in conns[1:]:
+        recv_message(conn)
+
+    logger.info(f"Worker: received config {config!r}")
+    del config["type"], config["size"]
+    synthesizer = setup(config)
+
+    threads = [Thread(target=work, args=(conn, synthesizer)) for conn in conns]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    synthesizer.shutdown(False)
+
+
+# EOF #
@@ -0,0 +1,125 @@
+# ttsprech - simple text to wav for the command line
+# Copyright (C) 2022 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from typing import Any, Callable, List, Optional, Sequence, Union, overload
+
+import hashlib
+import logging
+import mmap
+import os
+from array import array
+
+from ttsprech.tokenize import normalize_sentence
+
+
+logger = logging.getLogger(__name__)
+
+
+# bump when the tokenization changes, to invalidate cached indices
+INDEX_VERSION = 1
+
+
+class SentenceIndex(Sequence[str]):
+    """The sentences of a document as byte spans into its UTF-8 encoded
+    text, a sentence is only decoded and normalized when accessed"""
+
+    def __init__(self, data: Union[bytes, mmap.mmap], spans: 'array[int]') -> None:
+        self._data = data
+        self._spans = spans
+
+    def __len__(self) -> int:
+        return len(self._spans) // 2
+
+    @overload
+    def __getitem__(self, idx: int) -> str:
+        ...
+
+    @overload
+    def __getitem__(self, idx: slice) -> List[str]:
+        ...
+
+    def __getitem__(self, idx: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("sentence index out of range")
+
+        start, end = self._spans[2 * idx], self._spans[2 * idx + 1]
+        return normalize_sentence(self._data[start:end].decode("utf-8"))
+
+
+def build_spans(nltk_tokenize: Any, data: Union[bytes, mmap.mmap]) -> 'array[int]':
+    text = data[:].decode("utf-8")
+
+    # commas are treated as sentence boundaries, replacing them keeps
+    # the character offsets intact
+    spans = array("Q")
+    byte_pos = 0
+    char_pos = 0
+    for start, end in nltk_tokenize.span_tokenize(text.replace(",", ".")):
+        byte_pos += len(text[char_pos:start].encode("utf-8"))
+        byte_start = byte_pos
+        byte_pos += len(text[start:end].encode("utf-8"))
+        char_pos = end
+        spans.extend((byte_start, byte_pos))
+
+    return spans
+
+
+def _read_spans(index_file: str, data_size: int) -> Optional['array[int]']:
+    """Read a cached index, None when it is truncated or doesn't fit the data"""
+    logger.info(f"loading sentence index: {index_file}")
+    with open(index_file, "rb") as fin:
+        raw = fin.read()
+
+    spans = array("Q")
+    if len(raw) % (2 * spans.itemsize) != 0:
+        logger.warning(f"ignoring truncated sentence index: {index_file}")
+        return None
+
+    spans.frombytes(raw)
+    if spans and spans[-1] > data_size:
+        logger.warning(f"ignoring sentence index that doesn't match the text: {index_file}")
+        return None
+
+    return spans
+
+
+def load_sentence_index(cache_dir: str, nltk_tokenize_loader: Callable[[], Any],
+                        data: Union[bytes, mmap.mmap]) -> SentenceIndex:
+    """Return the SentenceIndex for `data`, the spans are cached by
+    content hash, so the tokenizer is only needed for new documents"""
+    digest = hashlib.sha256(data).hexdigest()
+    index_file = os.path.join(cache_dir, f"{digest}.v{INDEX_VERSION}.idx")
+
+    spans = _read_spans(index_file, len(data)) if os.path.isfile(index_file) else None
+    if spans is None:
+        spans = build_spans(nltk_tokenize_loader(), data)
+
+        logger.info(f"writing sentence index: {index_file}")
+        tmp_file = f"{index_file}.tmp{os.getpid()}"
+        with open(tmp_file, "wb") as fout:
+            spans.tofile(fout)
+        os.replace(tmp_file, index_file)
+
+    return SentenceIndex(data, spans)
+
+
+# EOF #
@@ -0,0 +1,126 @@
+# ttsprech - simple text to wav for the command line
+# Copyright (C) 2022 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# The ONNX models are converted from the Silero packages with
+# experimental/silero_to_onnx.py and have the following interface:
+#
+#   inputs:   "input"    int64[1, T]  symbol ids, see prepare_text_input()
+#             "speaker"  int64[1]     index into the "speakers" list
+#   outputs:  "audio"    float[1, N]  waveform in the range [-1, 1]
+#
+# and carry the metadata properties:
+#
+#   "symbols"      string of all symbols, the id is the index
+#   "speakers"     comma separated list of speaker names
+#   "sample_rate"  sample rate of "audio"
+#
+# Neither torch nor the Silero package are needed to run them.
+
+
+from typing import Any, Dict, List
+
+import logging
+import os
+import re
+
+from ttsprech.audio import resample, write_wav
+
+
+logger = logging.getLogger(__name__)
+
+
+def prepare_text_input(text: str, symbols: str) -> List[int]:
+    """Convert text to symbol ids, same as Silero's prepare_text_input(),
+    the first symbol is padding, the second end of sentence"""
+    text = text.lower()
+    text = re.sub(r'[^{}]'.format(symbols[2:]), '', text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    if not text:
+        # reported like silero's ValueError() for unspeakable text
+        raise ValueError("no speakable symbols in text")
+
+    if text[-1] not in ['.', '!', '?']:
+        text = text + '.'
+    text = text + symbols[1]
+
+    symbol_to_id = {symbol: idx for idx, symbol in enumerate(symbols)}
+    return [symbol_to_id[s] for s in text if s in symbol_to_id]
+
+
+class OnnxModel:
+
+    def __init__(self, session: Any) -> None:
+        metadata: Dict[str, str] = session.get_modelmeta().custom_metadata_map
+
+        self._session = session
+        self._speakers = metadata["speakers"].split(",")
+        self._symbols = metadata["symbols"]
+        self._synth_rate = int(metadata["sample_rate"])
+
+    @property
+    def speakers(self) -> List[str]:
+        return self._speakers
+
+    def save_wav(self, outfile: str, text: str, speaker: str, sample_rate: int, ssml: bool) -> None:
+        import numpy as np
+
+        if ssml:
+            raise RuntimeError("SSML is not supported by 'onnx'")
+
+        ids = prepare_text_input(text, self._symbols)
+
+        # InferenceSession.run() is thread safe, no locking needed
+        (audio,) = self._session.run(["audio"], {
+            "input": np.array([ids], dtype=np.int64),
+            "speaker": np.array([self._speakers.index(speaker)], dtype=np.int64),
+        })
+
+        write_wav(outfile, resample(audio[0], self._synth_rate, sample_rate), sample_rate)
+
+
+def onnx_model_from_file(model_file: str, num_threads: int) -> OnnxModel:
+    # only import onnxruntime when the engine is actually used
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = num_threads
+    options.inter_op_num_threads = 1
+
+    logger.info(f"loading ONNX model: {model_file}")
+    session = onnxruntime.InferenceSession(model_file, sess_options=options,
+                                           providers=["CPUExecutionProvider"])
+    model = OnnxModel(session)
+
+    logger.info(f"    Model: {model_file}")
+    logger.info(f" Speakers: {' '.join(model.speakers)}")
+
+    return model
+
+
+def onnx_model_from_language(language: str, cache_dir: str, num_threads: int) -> OnnxModel:
+    model_file = os.path.join(cache_dir, f"{language}.onnx")
+
+    if not os.path.isfile(model_file):
+        raise RuntimeError(f"no ONNX model for language '{language}', convert one with:\n  "
+                           f"python3 experimental/silero_to_onnx.py ~/.cache/ttsprech/silero/{language}.pt "
+                           f"{model_file}")
+
+    return onnx_model_from_file(model_file, num_threads)
+
+
+# EOF #
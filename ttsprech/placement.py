@@ -0,0 +1,240 @@
+# ttsprech - simple text to wav for the command line
+# Copyright (C) 2022 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Tuple
+
+import glob
+import logging
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+from threading import Lock, Thread, local
+
+
+logger = logging.getLogger(__name__)
+
+
+SYSFS_CPU = "/sys/devices/system/cpu"
+SYSFS_NODE = "/sys/devices/system/node"
+
+
+class Core(NamedTuple):
+    node: int
+    cpus: List[int]  # the core and its SMT siblings
+
+
+class Slot(NamedTuple):
+    node: int
+    cpus: List[int]
+    num_threads: int
+
+
+def parse_cpulist(text: str) -> List[int]:
+    """Parse a sysfs cpu list like '0-3,8-11'"""
+    cpus: List[int] = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _read_int(path: str, default: int) -> int:
+    try:
+        with open(path) as fin:
+            return int(fin.read())
+    except (OSError, ValueError):
+        return default
+
+
+def discover_cores() -> List[Core]:
+    """Return the physical cores this process may run on, ordered by
+    NUMA node, with SMT siblings grouped together"""
+    allowed = os.sched_getaffinity(0)
+
+    node_of_cpu: Dict[int, int] = {}
+    for node_dir in glob.glob(os.path.join(SYSFS_NODE, "node[0-9]*")):
+        node = int(re.sub(r"^.*node", "", node_dir))
+        with open(os.path.join(node_dir, "cpulist")) as fin:
+            for cpu in parse_cpulist(fin.read()):
+                node_of_cpu[cpu] = node
+
+    cores: Dict[Tuple[int, int, int], List[int]] = {}
+    for cpu in sorted(allowed):
+        topology = os.path.join(SYSFS_CPU, f"cpu{cpu}", "topology")
+        package = _read_int(os.path.join(topology, "physical_package_id"), 0)
+        core_id = _read_int(os.path.join(topology, "core_id"), cpu)
+        cores.setdefault((node_of_cpu.get(cpu, 0), package, core_id), []).append(cpu)
+
+    return [Core(key[0], cpus) for key, cpus in sorted(cores.items())]
+
+
+def plan_slots(cores: List[Core], max_workers: int) -> List[Slot]:
+    """Divide the cores into at most `max_workers` disjoint sets, none
+    of which crosses a NUMA node. Every node gets a worker while there
+    are enough of them, the rest are distributed proportional to the
+    nodes' core counts"""
+    nodes: Dict[int, List[Core]] = {}
+    for core in cores:
+        nodes.setdefault(core.node, []).append(core)
+
+    counts = {node: 0 for node in nodes}
+    for _ in range(max(1, min(max_workers, len(cores)))):
+        # nodes without a worker first, the larger ones if there aren't
+        # enough workers for all, then the node with most cores per worker
+        node = max((node for node in nodes if counts[node] < len(nodes[node])),
+                   key=lambda node: (counts[node] == 0, len(nodes[node]) / max(1, counts[node]), -node))
+        counts[node] += 1
+
+    slots: List[Slot] = []
+    for node, node_cores in sorted(nodes.items()):
+        count = counts[node]
+        quotient, remainder = divmod(len(node_cores), count) if count else (0, 0)
+        start = 0
+        for idx in range(count):
+            size = quotient + (1 if idx < remainder else 0)
+            chunk = node_cores[start:start + size]
+            start += size
+            slots.append(Slot(node, [cpu for core in chunk for cpu in core.cpus], len(chunk)))
+
+    return slots
+
+
+class Placement:
+    """Pins each thread of a worker pool to its own slot of cores, with
+    the number of intra-op threads matching the slot, and keeps a copy
+    of the model per NUMA node, or per slot for engines whose thread
+    pool belongs to the model"""
+
+    def __init__(self, slots: List[Slot]) -> None:
+        self._slots = slots
+        self._next_slot = 0
+        self._lock = Lock()
+        self._local = local()
+        self._models: Dict[int, Any] = {}
+        self._per_slot = False
+
+        self._start_time = time.monotonic()
+        self._busy = [0.0 for _ in slots]
+        self._tasks = [0 for _ in slots]
+
+        for idx, slot in enumerate(slots):
+            logger.info(f"worker {idx}: node {slot.node}, cpus {slot.cpus}, {slot.num_threads} threads")
+
+    @property
+    def num_workers(self) -> int:
+        return len(self._slots)
+
+    def load_models(self, loader: Callable[[Slot], Any], per_slot: bool = False) -> Any:
+        """Load one model per NUMA node from a thread pinned to that node,
+        so that its weights are allocated in the node's local memory.
+        With `per_slot` each slot gets its own model instead, loaded on
+        the slot's cores, `loader` receives the slot to size its threads"""
+        errors: List[BaseException] = []
+        self._per_slot = per_slot
+
+        groups: Dict[int, Tuple[Slot, List[int]]] = {}
+        for idx, slot in enumerate(self._slots):
+            key = idx if per_slot else slot.node
+            if key in groups:
+                groups[key][1].extend(slot.cpus)
+            else:
+                groups[key] = (slot, list(slot.cpus))
+
+        for key, (slot, cpus) in sorted(groups.items()):
+
+            def load(key: int = key, slot: Slot = slot, cpus: List[int] = cpus) -> None:
+                try:
+                    os.sched_setaffinity(0, cpus)
+                    self._models[key] = loader(slot)
+                except BaseException as err:  # pylint: disable=broad-except
+                    errors.append(err)
+
+            thread = Thread(target=load)
+            thread.start()
+            thread.join()
+            if errors:
+                raise errors[0]
+
+        return self._models[self._model_key(0)]
+
+    def pin_current_thread(self) -> None:
+        """Initializer for the pool threads, claims the next slot"""
+        with self._lock:
+            idx = self._next_slot
+            self._next_slot += 1
+            if idx == 0:
+                # don't count model loading against the utilization
+                self._start_time = time.monotonic()
+
+        os.sched_setaffinity(0, self._slots[idx].cpus)
+        self._local.idx = idx
+        self._local.initialized = False
+
+    def _model_key(self, idx: int) -> int:
+        return idx if self._per_slot else self._slots[idx].node
+
+    def _init_thread(self) -> None:
+        """Apply the slot's thread count, called from the first task, as
+        torch's per thread lazy init would undo it when done earlier"""
+        idx = self._local.idx
+        self._local.initialized = True
+
+        # the onnx engine never loads torch and sizes its sessions per
+        # slot instead, importing it here would only cost memory
+        if "torch" in sys.modules:
+            import torch
+
+            torch.get_num_threads()  # triggers the lazy init for this thread
+            torch.set_num_threads(self._slots[idx].num_threads)
+            logger.info(f"worker {idx}: torch uses {torch.get_num_threads()} threads")
+
+    def local_model(self) -> Any:
+        return self._models[self._model_key(self._local.idx)]
+
+    @contextmanager
+    def busy(self) -> Iterator[None]:
+        if not self._local.initialized:
+            self._init_thread()
+
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            idx = self._local.idx
+            self._busy[idx] += time.monotonic() - start
+            self._tasks[idx] += 1
+
+    def report(self) -> None:
+        elapsed = max(time.monotonic() - self._start_time, 1e-9)
+        for idx, slot in enumerate(self._slots):
+            logger.info(f"worker {idx} (node {slot.node}, cpus {slot.cpus}): "
+                        f"{self._tasks[idx]} sentences, {self._busy[idx]:.1f}s busy, "
+                        f"{100 * self._busy[idx] / elapsed:.0f}% utilization")
+
+
+def setup_placement(max_workers: int) -> Placement:
+    if not hasattr(os, "sched_setaffinity"):
+        raise RuntimeError("CPU pinning is not supported on this platform")
+
+    return Placement(plan_slots(discover_cores(), max_workers))
+
+
+# EOF #
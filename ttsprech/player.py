@@ -15,12 +15,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from typing import Optional, Tuple, Type
+from typing import Any, Iterator, Optional, Tuple, Type
 from types import TracebackType
 
-from threading import Thread
+from contextlib import contextmanager
+from threading import Event, RLock, Thread
 from queue import Queue
 import logging
+import signal
 import simpleaudio
 
 
@@ -29,14 +31,25 @@ logger = logging.getLogger(__name__)
 
 class Player:
 
-    def __init__(self, total: int) -> None:
+    def __init__(self, total: int, first: int = 0) -> None:
         self.queue: Queue[Optional[Tuple[str, Optional[str]]]] = Queue()
         self.wave_obj: Optional[simpleaudio.WaveObject] = None
         self.play_obj: Optional[simpleaudio.PlayObject] = None
         self.thread = Thread(target=lambda: self.run())
-        self.idx = 0
+        self.idx = first
         self.total = total
 
+        # reentrant, as skip() gets called from a signal handler in the
+        # main thread, which might be holding the lock already
+        self._lock = RLock()
+        self._skip = 0
+        self._stopped = Event()
+
+        # set while a dequeued sentence is being loaded or played,
+        # skip() then applies to it instead of the next one
+        self._current = False
+        self._skip_current = False
+
     def __enter__(self) -> 'Player':
         self.thread.start()
         return self
@@ -46,32 +59,107 @@ class Player:
                  exc_value: Optional[BaseException],
                  traceback: Optional[TracebackType]) -> Optional[bool]:
         logger.info("Player shutting down")
+        if exc_type is not None:
+            self.stop()
         self.queue.put(None)
-        self.thread.join()
+        try:
+            self.thread.join()
+        except BaseException:
+            # Ctrl-C while waiting for the playlist to finish, the
+            # caller is about to remove the .wav files
+            self.stop()
+            self.thread.join()
+            raise
         return None
 
     def add(self, text: str, filename: Optional[str]) -> None:
         logger.info(f"Player added {filename} to playlist")
         self.queue.put((text, filename))
 
+    def skip(self) -> None:
+        """Stop the current sentence, or drop the next one when nothing is playing"""
+        with self._lock:
+            if self._current:
+                logger.info("Player skipping current sentence")
+                self._skip_current = True
+                if self.play_obj is not None:
+                    self.play_obj.stop()
+            else:
+                logger.info("Player skipping next sentence")
+                self._skip += 1
+
+    def take_skip(self) -> bool:
+        """Consume a pending skip for a sentence that hasn't been added
+        to the playlist yet, so that its synthesis can be dropped"""
+        with self._lock:
+            if self._skip > 0 and self.queue.empty():
+                self._skip -= 1
+                self.idx += 1
+                return True
+            return False
+
+    def stop(self) -> None:
+        """Stop playback and discard the remaining playlist"""
+        logger.info("Player stopping")
+        with self._lock:
+            self._stopped.set()
+            if self.play_obj is not None:
+                self.play_obj.stop()
+
     def run(self) -> None:
         logger.info("Player started")
 
         progress_fmt = f"{{:{len(str(self.total))}d}}"
         while True:
             item = self.queue.get()
-            if item is None:
+            if item is None or self._stopped.is_set():
                 break
 
             text, wave_file = item
-            self.idx += 1
+            with self._lock:
+                self.idx += 1
+                if self._skip > 0:
+                    self._skip -= 1
+                    continue
+                self._current = True
+                self._skip_current = False
+
             print(("[" + progress_fmt + "/" + progress_fmt + "]  {}").format(
                 self.idx, self.total, text))
 
+            play_obj: Optional[simpleaudio.PlayObject] = None
             if wave_file is not None:
                 self.wave_obj = simpleaudio.WaveObject.from_wave_file(wave_file)
-                self.play_obj = self.wave_obj.play()
-                self.play_obj.wait_done()
+                with self._lock:
+                    if self._stopped.is_set():
+                        break
+                    if not self._skip_current:
+                        self.play_obj = play_obj = self.wave_obj.play()
+
+            if play_obj is not None:
+                play_obj.wait_done()
+
+            with self._lock:
+                self._current = False
+                self.play_obj = None
+
+
+@contextmanager
+def skip_on_sigquit(player: Player) -> Iterator[None]:
+    """Let Ctrl-\\ skip the current sentence while the player is active"""
+    if not hasattr(signal, "SIGQUIT"):
+        yield
+        return
+
+    def on_sigquit(signum: int, frame: Any) -> None:
+        del signum, frame
+        player.skip()
+
+    previous = signal.signal(signal.SIGQUIT, on_sigquit)
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGQUIT, previous)
 
 
 # EOF #
@@ -20,7 +20,8 @@ from typing import Any, List
 import logging
 import os
 import sys
-import torch
+
+from ttsprech.audio import resample, write_wav
 
 
 logger = logging.getLogger(__name__)
@@ -37,34 +38,59 @@ LANGUAGE_MODEL_URLS = {
     'indic': "https://models.silero.ai/models/tts/indic/v3_indic.pt",
 }
 
+# sample rates the silero v3 models can synthesize at directly
+SILERO_SAMPLE_RATES = [8000, 24000, 48000]
+
+# inference cost grows with the sample rate, 24kHz is indistinguishable
+# from 48kHz for speech, so synthesize at that and resample afterwards
+SILERO_DEFAULT_SYNTH_RATE = 24000
+
 
 class SileroModel:
 
-    def __init__(self, model: Any):
+    def __init__(self, model: Any, synth_rate: int = SILERO_DEFAULT_SYNTH_RATE):
+        if synth_rate not in SILERO_SAMPLE_RATES:
+            raise RuntimeError(f"unsupported synthesis rate '{synth_rate}', must be one of:\n  "
+                               f"{' '.join(str(rate) for rate in SILERO_SAMPLE_RATES)}")
+
         self._model = model
+        self._synth_rate = synth_rate
 
     @property
     def speakers(self) -> List[str]:
         return list(self._model.speakers)
 
     def save_wav(self, outfile: str, text: str, speaker: str, sample_rate: int, ssml: bool) -> None:
-        if ssml:
-            self._model.save_wav(audio_path=outfile,
-                                 ssml_text=text,
-                                 speaker=speaker,
-                                 sample_rate=sample_rate)
+        import torch
+
+        # no point in synthesizing above the output rate when the model
+        # can produce the output rate directly
+        if sample_rate in SILERO_SAMPLE_RATES:
+            synth_rate = min(sample_rate, self._synth_rate)
         else:
-            self._model.save_wav(audio_path=outfile,
-                                 text=text,
-                                 speaker=speaker,
-                                 sample_rate=sample_rate)
+            synth_rate = self._synth_rate
+
+        with torch.no_grad():
+            if ssml:
+                audio = self._model.apply_tts(ssml_text=text,
+                                              speaker=speaker,
+                                              sample_rate=synth_rate)
+            else:
+                audio = self._model.apply_tts(text=text,
+                                              speaker=speaker,
+                                              sample_rate=synth_rate)
+
+            write_wav(outfile, resample(audio.numpy(), synth_rate, sample_rate), sample_rate)
 
 
 def silero_languages() -> List[str]:
     return list(LANGUAGE_MODEL_URLS.keys())
 
 
-def silero_model_from_file(model_file: str) -> SileroModel:
+def silero_model_from_file(model_file: str, synth_rate: int = SILERO_DEFAULT_SYNTH_RATE) -> SileroModel:
+    # torch is only imported when silero is actually used
+    import torch
+
     device = torch.device('cpu')
     torch.set_num_threads(4)  # more than 4 does not provide a speedup
 
@@ -76,10 +102,11 @@ def silero_model_from_file(model_file: str) -> SileroModel:
     logger.info(f"Languages: {' '.join(LANGUAGE_MODEL_URLS.keys())}")
     logger.info(f"  peakers: {' '.join(model.speakers)}")
 
-    return SileroModel(model)
+    return SileroModel(model, synth_rate)
 
 
-def silero_model_from_language(language: str, cache_dir: str) -> SileroModel:
+def silero_model_from_language(language: str, cache_dir: str,
+                               synth_rate: int = SILERO_DEFAULT_SYNTH_RATE) -> SileroModel:
     if language not in LANGUAGE_MODEL_URLS:
         raise RuntimeError(f"unknown language '{language}', must be one of:\n  "
                            f"{' '.join(LANGUAGE_MODEL_URLS.keys())}")
@@ -88,10 +115,12 @@ def silero_model_from_language(language: str, cache_dir: str) -> SileroModel:
     model_file = os.path.join(cache_dir, f"{language}.pt")
 
     if not os.path.isfile(model_file):
+        import torch
+
         print(f"Downloading {model_url} to {model_file}", file=sys.stderr)
         torch.hub.download_url_to_file(model_url, dst=model_file, progress=True)
 
-    return silero_model_from_file(model_file)
+    return silero_model_from_file(model_file, synth_rate)
 
 
 # EOF #
@@ -0,0 +1,186 @@
+# ttsprech - simple text to wav for the command line
+# Copyright (C) 2022 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from typing import List, Optional
+
+import copy
+import logging
+import xml.etree.ElementTree as ET
+
+
+logger = logging.getLogger(__name__)
+
+
+# elements that start and end a fragment
+BOUNDARY_TAGS = ["p", "s"]
+
+# elements after which a fragment ends
+BREAK_TAGS = ["break"]
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _namespace(tag: str) -> str:
+    return tag[1:].split("}", 1)[0] if tag.startswith("{") else ""
+
+
+def _contains_split(elem: ET.Element) -> bool:
+    return any(_local_name(child.tag) in BOUNDARY_TAGS + BREAK_TAGS
+               for child in elem.iter() if child is not elem)
+
+
+class SSMLSplitter:
+    """Splits an SSML document into standalone SSML fragments at <p>,
+    <s> and <break> boundaries. Each fragment is wrapped in copies of
+    the elements enclosing it (<prosody>, <voice>, ...), so that it
+    keeps the same context as in the original document."""
+
+    def __init__(self, root: ET.Element) -> None:
+        self._root = root
+        self._namespace = _namespace(root.tag)
+        self._fragments: List[ET.Element] = []
+
+        # content without text, e.g. a leading <break>, that gets
+        # carried into the next fragment
+        self._pending: List[ET.Element] = []
+
+        # elements enclosing the current position in the input
+        self._stack: List[ET.Element] = []
+
+        # the root of the fragment that is currently being built,
+        # followed by the copies of self._stack it contains so far,
+        # None when no fragment is open
+        self._open: Optional[List[ET.Element]] = None
+
+    def split(self) -> List[str]:
+        root = self._root
+        if root.text:
+            self._append_text(root.text)
+        for child in root:
+            self._walk(child)
+            if child.tail:
+                self._append_text(child.tail)
+        self._flush()
+
+        if self._pending:
+            logger.info("dropping SSML without any text: "
+                        f"{''.join(ET.tostring(elem, encoding='unicode') for elem in self._pending)}")
+
+        return [ET.tostring(fragment, encoding="unicode") for fragment in self._fragments]
+
+    def _tag(self, tag: str) -> str:
+        # elements of the document's namespace are written unqualified,
+        # it is declared as the default namespace of each fragment
+        if _namespace(tag) == self._namespace:
+            return _local_name(tag)
+        return tag
+
+    def _walk(self, elem: ET.Element) -> None:
+        tag = _local_name(elem.tag)
+
+        if tag in BREAK_TAGS:
+            self._append_element(elem)
+            self._flush()
+        elif tag in BOUNDARY_TAGS or _contains_split(elem):
+            if tag in BOUNDARY_TAGS:
+                self._flush()
+
+            self._push(elem)
+            if elem.text:
+                self._append_text(elem.text)
+            for child in elem:
+                self._walk(child)
+                if child.tail:
+                    self._append_text(child.tail)
+            self._pop()
+
+            if tag in BOUNDARY_TAGS:
+                self._flush()
+        else:
+            self._append_element(elem)
+
+    def _push(self, elem: ET.Element) -> None:
+        self._stack.append(elem)
+
+    def _pop(self) -> None:
+        self._stack.pop()
+        if self._open is not None and len(self._open) > len(self._stack) + 1:
+            self._open.pop()
+
+    def _ensure_open(self) -> ET.Element:
+        # enclosing elements are only copied into the fragment once it
+        # receives content, to not leave empty ones behind
+        if self._open is None:
+            root = ET.Element(self._tag(self._root.tag), dict(self._root.attrib))
+            if self._namespace:
+                root.set("xmlns", self._namespace)
+            root.extend(self._pending)
+            self._pending = []
+            self._open = [root]
+        for elem in self._stack[len(self._open) - 1:]:
+            self._open.append(ET.SubElement(self._open[-1], self._tag(elem.tag), dict(elem.attrib)))
+        return self._open[-1]
+
+    def _append_text(self, text: str) -> None:
+        if self._open is None and not text.strip():
+            return
+
+        leaf = self._ensure_open()
+        if len(leaf) > 0:
+            leaf[-1].tail = (leaf[-1].tail or "") + text
+        else:
+            leaf.text = (leaf.text or "") + text
+
+    def _append_element(self, elem: ET.Element) -> None:
+        leaf = self._ensure_open()
+        child = copy.deepcopy(elem)
+        child.tail = None
+        for node in child.iter():
+            node.tag = self._tag(node.tag)
+        leaf.append(child)
+
+    def _flush(self) -> None:
+        if self._open is None:
+            return
+
+        fragment = self._open[0]
+        self._open = None
+
+        if not "".join(fragment.itertext()).strip():
+            # a fragment without text would fail to synthesize, its
+            # content, usually a <break>, goes to a neighbouring one
+            if self._fragments:
+                self._fragments[-1].extend(list(fragment))
+            else:
+                self._pending.extend(list(fragment))
+            return
+
+        self._fragments.append(fragment)
+
+
+def split_ssml(text: str) -> List[str]:
+    try:
+        root = ET.fromstring(text)
+    except ET.ParseError as err:
+        raise RuntimeError(f"failed to parse SSML: {err}") from err
+
+    return SSMLSplitter(root).split()
+
+
+# EOF #
@@ -15,7 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from typing import Any, List
+from typing import List
 
 import re
 import logging
@@ -55,7 +55,7 @@ LETTER2WORD = {
 }
 
 
-def prepare_text_for_tts(nltk_tokenize: Any, text: str) -> List[str]:
+def normalize_sentence(text: str) -> str:
     text = replace_numbers_with_words(text)
 
     # FIXME: This causes more problems than it fixes. Need better way
@@ -64,9 +64,7 @@ def prepare_text_for_tts(nltk_tokenize: Any, text: str) -> List[str]:
 
     text = text.replace(",", ".")
 
-    sentences: List[str] = nltk_tokenize.sentences_from_text(text)
-
-    return sentences
+    return text
 
 
 def replace_numbers_with_words(text: str) -> str:
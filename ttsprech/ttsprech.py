@@ -15,24 +15,31 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from typing import Any, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 import argparse
 import logging
+import mmap
 import os
+import shutil
 import sys
 import tempfile
-from concurrent.futures import ThreadPoolExecutor, Future
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from threading import Event
 from xdg.BaseDirectory import xdg_cache_home
 
 import langdetect
 import nltk
 
-from ttsprech.player import Player
-from ttsprech.tokenize import prepare_text_for_tts
+from ttsprech.player import Player, skip_on_sigquit
+from ttsprech.index import SentenceIndex, build_spans, load_sentence_index
+from ttsprech.ssml import split_ssml
 from ttsprech.silero import (silero_model_from_file, silero_model_from_language,
-                             silero_languages)
+                             silero_languages, SILERO_DEFAULT_SYNTH_RATE)
 from ttsprech.coqui import coqui_model_from_language
+from ttsprech.onnx import onnx_model_from_file, onnx_model_from_language
+from ttsprech.distributed import Coordinator, run_worker
+from ttsprech.placement import Placement, setup_placement
 
 
 logger = logging.getLogger(__name__)
@@ -42,6 +49,11 @@ NLTK_DATA_DIRS = "NLTK_DATA_DIRS_PLACEHOLDER"
 
 SILERO_MODEL_FILE = "SILERO_MODEL_FILE_PLACEHOLDER"
 
+LANGUAGE_DETECT_SIZE = 16384
+
+# options the coordinator sends to its workers
+WORKER_CONFIG_KEYS = ["engine", "lang", "speaker", "rate", "synth_rate", "onnx_threads", "ssml"]
+
 
 def parse_args(args: List[str]) -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Text to Speech")
@@ -51,7 +63,7 @@ def parse_args(args: List[str]) -> argparse.Namespace:
     parser.add_argument("-f", "--file", metavar="FILE", type=str, default=None,
                         help="Convert content of FILE to wav")
     parser.add_argument("-e", "--engine", metavar="ENGINE", type=str, default="silero",
-                        help="Select the TTS engine to use (coqui, silero)")
+                        help="Select the TTS engine to use (coqui, onnx, silero)")
     parser.add_argument("--ssml", action='store_true', default=False,
                         help="Interpret text input as SSML")
     parser.add_argument("-m", "--model", metavar="FILE", type=str, default=None,
@@ -61,15 +73,25 @@ def parse_args(args: List[str]) -> argparse.Namespace:
     parser.add_argument("-s", "--speaker", metavar="SPEAKER", type=str, default=None,
                         help="Speaker to use")
     parser.add_argument("-r", "--rate", metavar="RATE", type=int, default=48000,
-                        help="Sample rate")
+                        help="Sample rate of the output")
+    parser.add_argument("--synth-rate", metavar="RATE", type=int, default=SILERO_DEFAULT_SYNTH_RATE,
+                        help="Sample rate used for synthesis, resampled to --rate afterwards (silero only)")
+    parser.add_argument("--onnx-threads", metavar="NUM", type=int, default=4,
+                        help="Number of intra-op threads per sentence (onnx only, with --pin the slot's core count)")
     parser.add_argument("-S", "--start", metavar="NUM", type=int, default=0,
                         help="Start at sentence NUM")
     parser.add_argument("-E", "--end", metavar="NUM", type=int, default=None,
                         help="Stop at sentence NUM")
     parser.add_argument("-T", "--threads", metavar="NUM", type=int, default=None,
                         help="Number of threads to use")
+    parser.add_argument("--pin", action='store_true', default=False,
+                        help="Pin each thread to its own set of cores, one model copy per NUMA node")
     parser.add_argument("-O", "--output-dir", metavar="DIR", type=str, default=None,
                         help="Write .wav files to DIR")
+    parser.add_argument("--coordinator", metavar="ADDR", type=str, default=None,
+                        help="Distribute sentences to workers connecting to ADDR (HOST:PORT or unix:PATH)")
+    parser.add_argument("--worker", metavar="ADDR", type=str, default=None,
+                        help="Run as worker for the coordinator at ADDR")
     return parser.parse_args(args)
 
 
@@ -114,29 +136,30 @@ def setup_output_dir(opts: argparse.Namespace) -> str:
     return output_dir
 
 
-def setup_text(opts: argparse.Namespace) -> str:
-    text: str
+def setup_text(opts: argparse.Namespace) -> Union[bytes, mmap.mmap]:
+    """Return the UTF-8 encoded text, files are memory-mapped instead of read"""
+    data: Union[bytes, mmap.mmap]
 
     if opts.file:
-        with open(opts.file) as fin:
-            text = fin.read()
+        with open(opts.file, "rb") as fin:
+            if os.fstat(fin.fileno()).st_size == 0:
+                raise RuntimeError(f"no text given, '{opts.file}' is empty")
+            data = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
     else:
         if not opts.TEXT:
             raise RuntimeError("no text given")
 
-        text = " ".join(opts.TEXT)
-
-    if text is None:
-        raise RuntimeError("no text given, use --text TEXT or --file PATH")
+        data = " ".join(opts.TEXT).encode("utf-8")
 
-    return text
+    return data
 
 
-def setup_language(text: str, opts: argparse.Namespace) -> str:
+def setup_language(data: Union[bytes, mmap.mmap], opts: argparse.Namespace) -> str:
     language: str
 
     if opts.lang is None:
-        language = langdetect.detect(text)
+        # the beginning of the text is plenty for detection
+        language = langdetect.detect(data[:LANGUAGE_DETECT_SIZE].decode("utf-8", errors="ignore"))
         logger.info(f"autodetected language: '{language}'")
         if language not in silero_languages():
             logger.warning(f"autodetected '{language}' not available, fallback to 'en'")
@@ -151,11 +174,35 @@ def setup_model(opts: argparse.Namespace, language: str, cache_dir: str) -> Any:
     model: Any
 
     if opts.model is not None:
-        model = silero_model_from_file(opts.model)
+        model = silero_model_from_file(opts.model, opts.synth_rate)
     elif language == "en" and os.path.isfile(SILERO_MODEL_FILE):
-        model = silero_model_from_file(SILERO_MODEL_FILE)
+        model = silero_model_from_file(SILERO_MODEL_FILE, opts.synth_rate)
+    else:
+        model = silero_model_from_language(language, cache_dir, opts.synth_rate)
+
+    return model
+
+
+def setup_engine(opts: argparse.Namespace, language: str, cache_dir: str) -> Any:
+    model: Any
+
+    if opts.engine == "coqui":
+        model = coqui_model_from_language(language)
+    elif opts.engine == "silero":
+        silero_cachedir = os.path.join(cache_dir, "silero")
+        if not os.path.isdir(silero_cachedir):
+            os.mkdir(silero_cachedir)
+        model = setup_model(opts, language, silero_cachedir)
+    elif opts.engine == "onnx":
+        onnx_cachedir = os.path.join(cache_dir, "onnx")
+        if not os.path.isdir(onnx_cachedir):
+            os.mkdir(onnx_cachedir)
+        if opts.model is not None:
+            model = onnx_model_from_file(opts.model, opts.onnx_threads)
+        else:
+            model = onnx_model_from_language(language, onnx_cachedir, opts.onnx_threads)
     else:
-        model = silero_model_from_language(language, cache_dir)
+        raise RuntimeError(f"unknown engine: '{opts.engine}'")
 
     return model
 
@@ -175,13 +222,20 @@ def setup_speaker(opts: argparse.Namespace, model: Any) -> str:
     return speaker
 
 
-def setup_sentences(opts: argparse.Namespace, nltk_tokenize: Any, text: str) -> List[str]:
+def setup_sentences(opts: argparse.Namespace, cache_dir: str, data: Union[bytes, mmap.mmap]) -> Sequence[str]:
     if opts.ssml:
-        return [text]
+        return split_ssml(data[:].decode("utf-8"))
+
+    # only files are worth keeping an index for, TEXT arguments are
+    # short and rarely repeated
+    if not opts.file:
+        return SentenceIndex(data, build_spans(setup_nltk_tokenize(opts), data))
 
-    sentences = prepare_text_for_tts(nltk_tokenize, text)
+    index_cachedir = os.path.join(cache_dir, "index")
+    if not os.path.isdir(index_cachedir):
+        os.mkdir(index_cachedir)
 
-    return sentences
+    return load_sentence_index(index_cachedir, lambda: setup_nltk_tokenize(opts), data)
 
 
 def setup_max_workers(opts: argparse.Namespace) -> int:
@@ -198,7 +252,12 @@ def setup_max_workers(opts: argparse.Namespace) -> int:
     return max_workers
 
 
-def save_wav(outfile: str, model: Any, text: str, speaker: str, sample_rate: int, ssml: bool) -> Optional[str]:
+def save_wav(outfile: str, model: Any, text: str, speaker: str, sample_rate: int, ssml: bool,
+             cancel: Event, skip: Event) -> Optional[str]:
+    """`cancel` aborts the whole session, `skip` only this sentence"""
+    if cancel.is_set() or skip.is_set():
+        return None
+
     logger.info(f"Processing {outfile}: {text!r}")
     try:
         model.save_wav(outfile=outfile,
@@ -212,46 +271,155 @@ def save_wav(outfile: str, model: Any, text: str, speaker: str, sample_rate: int
         logger.error(f"failed to process {text!r}: {err!r}")
         return None
 
+    if cancel.is_set() or skip.is_set():
+        # session got aborted or sentence skipped while it was in flight
+        logger.info(f"Abandoned: {outfile}")
+        os.remove(outfile)
+        return None
+
     return outfile
 
 
-def run(opts: argparse.Namespace, model: Any, speaker: str, sentences: List[str],
-        output_dir: str, max_workers: int) -> None:
+def schedule_longest_first(tasks: List[Tuple[int, str]]) -> List[Tuple[int, str]]:
+    """Order tasks by decreasing text length, which is a good estimate
+    of the synthesis time. Submitting the longest sentences first keeps
+    a long sentence from being left as the sole straggler at the end of
+    an offline render while the other workers sit idle."""
+    return sorted(tasks, key=lambda task: len(task[1]), reverse=True)
+
+
+def wait_for_sentence(player: Player, future: Future[Optional[str]], skip: Event) -> bool:
+    """Wait for `future` to finish, returns False if the user skipped
+    the sentence in the meantime, in which case its work is dropped"""
+    while not player.take_skip():
+        if wait([future], timeout=0.1).done:
+            return True
+
+    # cancel() only works for sentences that haven't started yet,
+    # `skip` makes a running one discard its output
+    skip.set()
+    future.cancel()
+    return False
+
+
+def play_sentences(output_files: List[Tuple[str, Future[Optional[str]], Event]], total: int, first: int) -> None:
+    with Player(total, first) as player, skip_on_sigquit(player):
+        for text, outfile_future, skip in output_files:
+            if wait_for_sentence(player, outfile_future, skip):
+                player.add(text, outfile_future.result())
+
+
+class LocalSynthesizer:
+    """Synthesizes sentences in a thread pool on this machine"""
+
+    def __init__(self, model: Any, speaker: str, opts: argparse.Namespace, max_workers: int,
+                 placement: Optional[Placement] = None) -> None:
+        self._model = model
+        self._speaker = speaker
+        self._rate = opts.rate
+        self._ssml = opts.ssml
+        self._cancel = Event()
+        self._placement = placement
+
+        if placement is None:
+            self._executor = ThreadPoolExecutor(max_workers)
+        else:
+            self._executor = ThreadPoolExecutor(placement.num_workers,
+                                                initializer=placement.pin_current_thread)
+
+    def submit(self, outfile: str, text: str, skip: Event) -> Future[Optional[str]]:
+        return self._executor.submit(self._save_wav, outfile, text, skip)
+
+    def shutdown(self, cancel: bool) -> None:
+        if cancel:
+            self._cancel.set()
+        self._executor.shutdown(wait=True, cancel_futures=cancel)
+
+        if self._placement is not None:
+            self._placement.report()
+
+    def _save_wav(self, outfile: str, text: str, skip: Event) -> Optional[str]:
+        if self._placement is None:
+            return save_wav(outfile, self._model, text, self._speaker, self._rate, self._ssml,
+                            self._cancel, skip)
+
+        with self._placement.busy():
+            return save_wav(outfile, self._placement.local_model(), text, self._speaker,
+                            self._rate, self._ssml, self._cancel, skip)
+
+
+def run(opts: argparse.Namespace, synthesizer: Any, sentences: Sequence[str], output_dir: str) -> None:
     use_player = opts.output_dir is None
+    cancel = False
+
+    try:
+        # only the sentences within --start/--end are ever looked at
+        first = max(opts.start, 1) - 1
+        last = len(sentences) if opts.end is None else max(first, min(len(sentences), opts.end - 1))
+        tasks: List[Tuple[int, str]] = [(idx, sentences[idx]) for idx in range(first, last)]
+
+        skips = {idx: Event() for idx, _ in tasks}
+        futures: Dict[int, Future[Optional[str]]] = {}
+        for idx, sentence in (tasks if use_player else schedule_longest_first(tasks)):
+            outfile = os.path.join(output_dir, f"{idx + 1:06d}.wav")
+            futures[idx] = synthesizer.submit(outfile, sentence, skips[idx])
+
+        output_files: List[Tuple[str, Future[Optional[str]], Event]] = [
+            (sentence, futures[idx], skips[idx]) for idx, sentence in tasks
+        ]
 
-    with ThreadPoolExecutor(max_workers) as executor:
-        output_files: List[Tuple[str, Future[Optional[str]]]] = []
-
-        for idx, sentence in enumerate(sentences):
-            skip_sentence = (((idx + 1) < opts.start) or
-                             (opts.end is not None and (idx + 1) >= opts.end))
-            if skip_sentence:
-                future: Future[Optional[str]] = Future()
-                future.set_result(None)
-                output_files.append((sentence, future))
-            else:
-                outfile = os.path.join(output_dir, f"{idx + 1:06d}.wav")
-                task = executor.submit(save_wav,
-                                       outfile, model, sentence, speaker, opts.rate, opts.ssml)
-                output_files.append((sentence, task))
+        if use_player:
+            play_sentences(output_files, len(sentences), first)
+        else:
+            for _, outfile_future, _ in output_files:
+                outfile_future.result()
+    except BaseException:
+        # KeyboardInterrupt or a failed sentence, don't keep the CPU
+        # busy with work nobody is waiting for
+        logger.info("aborting, cancelling outstanding sentences")
+        cancel = True
+        raise
+    finally:
+        synthesizer.shutdown(cancel)
 
         if use_player:
-            files_to_cleanup: List[str] = []
-
-            with Player(len(output_files)) as player:
-                for text, outfile_future in output_files:
-                    maybe_wavfile = outfile_future.result()
-                    if maybe_wavfile:
-                        files_to_cleanup.append(maybe_wavfile)
-                    player.add(text, maybe_wavfile)
-
-            # cleanup
-            logger.info("cleaning up generated files")
-            for file in files_to_cleanup:
-                logger.info(f"removing file '{file}'")
-                os.remove(file)
             logger.info(f"removing directory '{output_dir}'")
-            os.rmdir(output_dir)
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def setup_local_synthesizer(opts: argparse.Namespace, language: str, cache_dir: str) -> LocalSynthesizer:
+    max_workers = setup_max_workers(opts)
+    placement: Optional[Placement] = None
+
+    if opts.pin:
+        placement = setup_placement(max_workers)
+        if opts.engine == "onnx":
+            # ONNX Runtime's thread pool belongs to the session, so each
+            # slot gets its own session sized to the slot's cores
+            model = placement.load_models(
+                lambda slot: setup_engine(argparse.Namespace(**{**vars(opts), "onnx_threads": slot.num_threads}),
+                                          language, cache_dir),
+                per_slot=True)
+        else:
+            model = placement.load_models(lambda slot: setup_engine(opts, language, cache_dir))
+    else:
+        model = setup_engine(opts, language, cache_dir)
+
+    speaker = setup_speaker(opts, model)
+    return LocalSynthesizer(model, speaker, opts, max_workers, placement)
+
+
+def setup_worker(opts: argparse.Namespace, cache_dir: str, config: Dict[str, Any]) -> LocalSynthesizer:
+    """Load the model requested by the coordinator, the worker's own
+    --model, --pin and --threads apply"""
+    # the coordinator is an unauthenticated peer, it only gets to
+    # choose what the protocol defines
+    if sorted(config.keys()) != sorted(WORKER_CONFIG_KEYS):
+        raise RuntimeError(f"invalid config from coordinator, expected keys {' '.join(WORKER_CONFIG_KEYS)}, "
+                           f"got {' '.join(sorted(config.keys()))}")
+
+    worker_opts = argparse.Namespace(**{**vars(opts), **config})
+    return setup_local_synthesizer(worker_opts, worker_opts.lang, cache_dir)
 
 
 def main(argv: List[str]) -> None:
@@ -263,26 +431,37 @@ def main(argv: List[str]) -> None:
         logging.basicConfig(level=logging.WARNING)
 
     cache_dir = setup_cachedir()
-    nltk_tokenize = setup_nltk_tokenize(opts)
-    output_dir = setup_output_dir(opts)
-    text = setup_text(opts)
-    language = setup_language(text, opts)
 
-    if opts.engine == "coqui":
-        model = coqui_model_from_language(language)
-    elif opts.engine == "silero":
-        silero_cachedir = os.path.join(cache_dir, "silero")
-        if not os.path.isdir(silero_cachedir):
-            os.mkdir(silero_cachedir)
-        model = setup_model(opts, language, silero_cachedir)
-    else:
-        raise RuntimeError(f"unknown engine: '{opts.engine}'")
+    if opts.worker is not None:
+        run_worker(opts.worker, setup_max_workers(opts),
+                   lambda config: setup_worker(opts, cache_dir, config))
+        return
 
-    speaker = setup_speaker(opts, model)
-    sentences = setup_sentences(opts, nltk_tokenize, text)
-    max_workers = setup_max_workers(opts)
+    if opts.coordinator is not None and opts.pin:
+        raise RuntimeError("--pin has no effect with --coordinator, pass it to the workers instead")
+
+    output_dir = setup_output_dir(opts)
+    data = setup_text(opts)
+    language = setup_language(data, opts)
+    sentences = setup_sentences(opts, cache_dir, data)
+
+    synthesizer: Any
+    if opts.coordinator is not None:
+        # the model is only loaded by the workers, --model is not
+        # forwarded as the path is local to this machine
+        synthesizer = Coordinator(opts.coordinator, {  # keys must match WORKER_CONFIG_KEYS
+            "engine": opts.engine,
+            "lang": language,
+            "speaker": opts.speaker,
+            "rate": opts.rate,
+            "synth_rate": opts.synth_rate,
+            "onnx_threads": opts.onnx_threads,
+            "ssml": opts.ssml,
+        })
+    else:
+        synthesizer = setup_local_synthesizer(opts, language, cache_dir)
 
-    run(opts, model, speaker, sentences, output_dir, max_workers)
+    run(opts, synthesizer, sentences, output_dir)
 
 
 def main_entrypoint() -> None:
@@ -290,6 +469,9 @@ def main_entrypoint() -> None:
         main(sys.argv)
     except RuntimeError as err:
         print(f"error: {err}", file=sys.stderr)
+    except KeyboardInterrupt:
+        print("interrupted", file=sys.stderr)
+        sys.exit(130)
 
 
 if __name__ == "__main__":